@@ -1,27 +1,209 @@
+import functools
+import io
+import queue
+import socket
+import struct
 import threading
-from datetime import datetime
-from typing import Optional
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
 
+import orjson
 import requests
 from flask import Flask, request, render_template
 from flask_socketio import SocketIO
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
+
+class _OrJson:
+    """json-module shim so python-socketio/engineio encode packets with orjson."""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # separators etc. are ignored: orjson always emits compact JSON
+        return orjson.dumps(obj).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'docker-streamer-secret'
-# Use threading async mode so this works without eventlet/gevent (useful on Windows)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# Use threading async mode so this works without eventlet/gevent (useful on Windows).
+# WebSocket frames are already compressed: simple-websocket negotiates permessage-deflate
+# with the browser. http_compression covers the long-polling transport; log batches are
+# small but very compressible, so compress anything over 256 bytes instead of engineio's 1 KiB.
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', json=_OrJson,
+                    http_compression=True, compression_threshold=256)
 
 # Store user sessions and their docker clients
 user_sessions: dict[str, dict] = {}
-# active_streams maps "sid:container_id" -> {"thread": Thread, "stop_event": Event}
-active_streams: dict[str, dict] = {}
+# active_streams maps sid -> container_id ->
+#   {"future": Future, "stop_event": StopEvent, "ring": deque, "rate_limiter": LineRateLimiter}
+active_streams: defaultdict[str, dict[str, dict]] = defaultdict(dict)
+
+# Shared worker pool for log streams, so reconnect floods don't spawn unbounded threads.
+# Streams are stopped cooperatively through their stop_event, never by cancelling the future.
+MAX_LOG_STREAMS = 64
+_executor = ThreadPoolExecutor(max_workers=MAX_LOG_STREAMS, thread_name_prefix='log-stream')
+# A followed stream holds its worker for as long as it runs, so work queued behind a full
+# pool might never start. Each running or pending stream takes a slot; start_logs refuses
+# new streams when none are left.
+_stream_slots = threading.BoundedSemaphore(MAX_LOG_STREAMS)
+
+# Container listings are shared between sessions pointing at the same daemon (and user)
+# for CONTAINERS_CACHE_TTL seconds: (docker_url, username) -> (fetched_at, container_list)
+CONTAINERS_CACHE_TTL = 2.0
+_containers_cache: dict[tuple, tuple[float, list]] = {}
+# One lock per daemon so concurrent refreshes make a single Docker API call
+_containers_locks: defaultdict[tuple, threading.Lock] = defaultdict(threading.Lock)
+
+# Log lines go through a bounded per-session send queue; when a client can't keep up,
+# new lines are dropped and counted instead of piling up in server memory.
+SEND_QUEUE_SIZE = 1000
+# Seconds between 'log_dropped' notifications and rate-limit summaries
+DROP_REPORT_INTERVAL = 0.5
+# The sender coalesces queued lines into 'log_batch' emits: flushed when a batch fills up
+# or when the flush interval (seconds) elapses, whichever comes first.
+LOG_BATCH_SIZE = 50
+LOG_FLUSH_INTERVAL = 0.1
+# A stream logging more than RATE_LIMIT_THRESHOLD lines/sec is throttled to that rate,
+# forwarded in RATE_LIMIT_WINDOW-second slices. The sender reports what was held back as a
+# "(+N more lines)" summary every DROP_REPORT_INTERVAL.
+RATE_LIMIT_THRESHOLD = 500
+RATE_LIMIT_WINDOW = 0.25
+# Most recent lines kept per stream for 'replay'
+REPLAY_BUFFER_SIZE = 2000
+# Bytes requested per socket read of a log stream
+LOG_READ_SIZE = 65536
+
+
+class LineRateLimiter:
+    """
+    Tracks the line rate of one log stream. Once it goes over `threshold` lines in a
+    one-second window the stream is in high-rate mode: only `threshold * window` lines
+    per `window` seconds are let through and the rest are counted as suppressed.
+    The mode is re-evaluated every second, so it ends when the rate drops.
+    allow() is called by the stream's worker; take_suppressed() may be called from any thread.
+    """
+
+    def __init__(self, threshold: int = RATE_LIMIT_THRESHOLD, window: float = RATE_LIMIT_WINDOW):
+        self.threshold = threshold
+        self.window = window
+        self.window_budget = max(1, int(threshold * window))
+        self.high_rate = False
+        self.suppressed = 0
+        self._suppressed_lock = threading.Lock()
+        self._second_start = 0.0
+        self._second_count = 0
+        self._window_start = 0.0
+        self._window_count = 0
+
+    def allow(self, now: float) -> bool:
+        if now - self._second_start >= 1.0:
+            self.high_rate = self._second_count > self.threshold
+            self._second_start = now
+            self._second_count = 0
+        self._second_count += 1
+
+        if not self.high_rate:
+            if self._second_count <= self.threshold:
+                return True
+            self.high_rate = True
+            self._window_start = now
+            self._window_count = 0
+
+        if now - self._window_start >= self.window:
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+        if self._window_count <= self.window_budget:
+            return True
+        with self._suppressed_lock:
+            self.suppressed += 1
+        return False
+
+    def take_suppressed(self) -> int:
+        with self._suppressed_lock:
+            suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
+
+
+def rate_summary_entry(suppressed: int) -> dict:
+    return {'message': f'(+{suppressed} more lines, log rate over {RATE_LIMIT_THRESHOLD}/s)',
+            'stream': 'system', 'timestamp': int(time.time() * 1000)}
+
+
+class StopEvent(threading.Event):
+    """
+    threading.Event that also runs registered callbacks when set, so a stream blocked
+    in a socket read can be interrupted instead of noticing the stop on its next line.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """Run callback when the event is set (immediately if it already is)."""
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def set(self):
+        super().set()
+        with self._callbacks_lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class _Read1Stream(io.RawIOBase):
+    """
+    Raw stream over a urllib3 response for io.BufferedReader. The response's own readinto()
+    blocks until the whole buffer is filled, which would hold back followed logs; read1()
+    returns whatever has arrived.
+    """
+
+    def __init__(self, response):
+        self._response = response
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._response.read1(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
 
 
 class DockerAPIClient:
     def __init__(self, base_url: str, username: Optional[str] = None, password: Optional[str] = None):
         self.base_url = base_url.rstrip('/')
+        self.username = username
         self.auth = HTTPBasicAuth(username, password) if username and password else None
+        # Reuse keep-alive connections across container listings and log streams
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # container id -> Config.Tty; fixed for a container's lifetime, so never expires
+        self._tty_cache: dict[str, bool] = {}
+
+    def close(self):
+        self.session.close()
 
     def list_containers(self, all: bool = False):
         url = f"{self.base_url}/containers/json"
@@ -31,17 +213,59 @@ class DockerAPIClient:
             if self.auth:
                 kwargs['auth'] = self.auth
 
-            response = requests.get(url, **kwargs)
+            response = self.session.get(url, **kwargs)
             response.raise_for_status()
             return response.json()
         except Exception as e:
             print(f"Error listing containers: {e}")
             return None
 
-    def stream_logs_generator(self, container_id: str, stop_event: threading.Event, follow: bool = True, tail: int = 50):
+    def inspect_container(self, container_id: str):
+        url = f"{self.base_url}/containers/{container_id}/json"
+        try:
+            kwargs = {'timeout': 10}
+            if self.auth:
+                kwargs['auth'] = self.auth
+
+            response = self.session.get(url, **kwargs)
+            response.raise_for_status()
+            info = response.json()
+            self._tty_cache[container_id] = bool((info.get('Config') or {}).get('Tty'))
+            return info
+        except Exception as e:
+            print(f"Error inspecting container {container_id}: {e}")
+            return None
+
+    def container_tty(self, container_id: str) -> bool:
+        """Whether the container runs with a TTY (raw log stream) rather than multiplexed output."""
+        if container_id not in self._tty_cache:
+            if self.inspect_container(container_id) is None:
+                # Docker's default is no TTY, i.e. a multiplexed stream
+                return False
+        return self._tty_cache[container_id]
+
+    # Stream type byte of a multiplexed frame header -> name used by the client's CSS classes
+    STREAM_NAMES = {1: 'stdout', 2: 'stderr'}
+
+    @staticmethod
+    def _interrupt_response(response):
+        # Shutting the socket down wakes up a read blocked on it with EOF
+        sock = getattr(response.raw.connection, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def stream_logs_generator(self, container_id: str, stop_event: StopEvent, follow: bool = True, tail: int = 50,
+                              tty: bool = False):
         """
-        Generator that yields log lines until stop_event is set.
-        Handles Docker's multiplexed stdout/stderr header if present.
+        Generator that yields (stream, line) tuples until stop_event is set, where stream
+        is 'stdout' or 'stderr'. Setting stop_event interrupts a pending read, so a quiet
+        container's stream ends right away.
+        Without a TTY, Docker multiplexes stdout/stderr into frames: an 8-byte header
+        (1 byte stream type, 3 zero bytes, 4-byte big-endian length) followed by the payload.
+        With a TTY the stream is raw text and everything is reported as stdout.
         """
         url = f"{self.base_url}/containers/{container_id}/logs"
         params = {
@@ -52,6 +276,8 @@ class DockerAPIClient:
             'tail': str(tail)
         }
 
+        response = None
+        interrupt = None
         try:
             kwargs = {
                 'params': params,
@@ -61,48 +287,72 @@ class DockerAPIClient:
             if self.auth:
                 kwargs['auth'] = self.auth
 
-            response = requests.get(url, **kwargs)
+            response = self.session.get(url, **kwargs)
             response.raise_for_status()
 
-            buffer = b''
-            for chunk in response.iter_content(chunk_size=1024):
-                if stop_event.is_set():
-                    break
-                if not chunk:
-                    continue
-                buffer += chunk
-                while b'\n' in buffer:
-                    line, buffer = buffer.split(b'\n', 1)
+            interrupt = functools.partial(self._interrupt_response, response)
+            stop_event.add_callback(interrupt)
+
+            # Docker doesn't compress log streams; only route reads through urllib3's decoder
+            # (and its intermediate buffer) if something in between did
+            response.raw.decode_content = 'Content-Encoding' in response.headers
+            reader = io.BufferedReader(_Read1Stream(response.raw), buffer_size=LOG_READ_SIZE)
+
+            # Bytes already read that turned out to be raw text rather than a frame header
+            prefix = b''
+            if not tty:
+                # Multiplexed stream: read whole frames by their length prefix
+                stream_names = self.STREAM_NAMES
+                while not stop_event.is_set():
+                    header = reader.read(8)
+                    if not header:
+                        break
+                    if header[0] > 2 or header[1:4].strip(b'\x00'):
+                        # Not a frame header (stream type 0-2, zero padding): the container has a
+                        # TTY after all, e.g. because inspecting it failed. Read it as raw text.
+                        self._tty_cache[container_id] = True
+                        prefix = header
+                        break
+                    if len(header) < 8:
+                        break
+                    stream_type, length = struct.unpack('>BxxxI', header)
+                    payload = reader.read(length)
+                    stream = stream_names.get(stream_type, 'stdout')
+                    # Only '\n' separates lines (str.splitlines() would also split on \x0c, \x1e, \u2028, ...);
+                    # strip() drops any '\r'
+                    for line in payload.decode('utf-8', errors='ignore').split('\n'):
+                        line = line.strip()
+                        if line:
+                            yield stream, line
+
+            if tty or prefix:
+                # Raw stream: let the C-level readline scan for newlines
+                while not stop_event.is_set():
+                    line = reader.readline()
+                    if prefix:
+                        line, prefix = prefix + line, b''
                     if not line:
-                        continue
-                    try:
-                        # Docker may return multiplexed frames: 8-byte header then payload
-                        # header format: 1 byte stream type (0=stdin,1=stdout,2=stderr), 3 bytes zeros, 4 byte length
-                        # We operate on raw bytes:
-                        payload = line
-                        if len(payload) >= 8:
-                            first_byte = payload[0]
-                            # if first_byte looks like 1 or 2 (stdout/stderr), assume multiplexed -> strip 8
-                            if first_byte in (1, 2):
-                                payload = payload[8:]
-
-                        decoded_line = payload.decode('utf-8', errors='ignore').rstrip('\r')
-                        cleaned_line = decoded_line.strip()
-                        if cleaned_line:
-                            yield cleaned_line
-                    except Exception as e:
-                        print(f"Error decoding log line: {e}")
-                        # skip problematic line
-                        continue
-
-                # check stop_event again in case it's set while processing buffer
-                if stop_event.is_set():
-                    break
+                        # EOF: readline already returned any trailing partial line
+                        break
+                    # strip() also drops the trailing \r\n; decoding with errors='ignore' can't raise.
+                    # Only a misread header prefix can hold more than one line.
+                    for part in line.decode('utf-8', errors='ignore').split('\n'):
+                        part = part.strip()
+                        if part:
+                            yield 'stdout', part
 
         except Exception as e:
+            if stop_event.is_set():
+                # Expected: the read was interrupted by stop_event
+                return
             print(f"Error streaming logs from Docker API: {e}")
             # propagate to caller so they can emit error
             raise
+        finally:
+            if interrupt is not None:
+                stop_event.remove_callback(interrupt)
+            if response is not None:
+                response.close()
 
 @app.route('/')
 def index():
@@ -115,7 +365,12 @@ def get_user_session(sid: str):
         user_sessions[sid] = {
             'docker_client': None,
             'docker_url': None,
-            'connected': False
+            'connected': False,
+            'send_queue': queue.Queue(maxsize=SEND_QUEUE_SIZE),
+            'send_lock': threading.Lock(),
+            'dropped': 0,
+            'sender_started': False,
+            'sender_stop': threading.Event()
         }
     return user_sessions[sid]
 
@@ -136,9 +391,16 @@ def connect_docker(data):
         # Test connection
         containers = docker_client.list_containers()
         if containers is None:
+            docker_client.close()
             raise Exception("Failed to connect to Docker API")
 
+        # Replace any previous connection
+        if session['docker_client']:
+            stop_user_streams(sid)
+            session['docker_client'].close()
+
         # Store successful connection
+        invalidate_containers_cache(url, username)
         session['docker_client'] = docker_client
         session['docker_url'] = url
         session['connected'] = True
@@ -166,6 +428,9 @@ def disconnect_docker():
     stop_user_streams(sid)
 
     # Clear docker connection
+    if session['docker_client']:
+        invalidate_containers_cache(session['docker_url'], session['docker_client'].username)
+        session['docker_client'].close()
     session['docker_client'] = None
     session['docker_url'] = None
     session['connected'] = False
@@ -184,19 +449,28 @@ def get_containers():
         return
 
     try:
-        containers_data = session['docker_client'].list_containers(all=True)
-        if containers_data is None:
-            socketio.emit('error', {'message': 'Failed to get containers from Docker API'}, room=sid)
-            return
-
-        container_list = []
-        for container in containers_data:
-            container_list.append({
-                'id': container.get('Id'),
-                'name': (container.get('Names') or [''])[0].lstrip('/') if container.get('Names') else '',
-                'image': container.get('Image'),
-                'state': container.get('State')
-            })
+        docker_client = session['docker_client']
+        cache_key = (session['docker_url'], docker_client.username)
+
+        with _containers_locks[cache_key]:
+            cached = _containers_cache.get(cache_key)
+            if cached and time.monotonic() - cached[0] < CONTAINERS_CACHE_TTL:
+                container_list = cached[1]
+            else:
+                containers_data = docker_client.list_containers(all=True)
+                if containers_data is None:
+                    socketio.emit('error', {'message': 'Failed to get containers from Docker API'}, room=sid)
+                    return
+
+                get = dict.get
+                container_list = [{
+                    'id': get(c, 'Id'),
+                    # Docker always prefixes names with a single '/'
+                    'name': (get(c, 'Names') or ('',))[0][1:],
+                    'image': get(c, 'Image'),
+                    'state': get(c, 'State')
+                } for c in containers_data]
+                _containers_cache[cache_key] = (time.monotonic(), container_list)
 
         socketio.emit('containers', container_list, room=sid)
 
@@ -205,6 +479,10 @@ def get_containers():
         socketio.emit('error', {'message': f'Failed to get containers: {str(e)}'}, room=sid)
 
 
+def invalidate_containers_cache(docker_url: str, username: Optional[str]):
+    _containers_cache.pop((docker_url, username), None)
+
+
 @socketio.on('start_logs')
 def start_logs(data):
     sid = request.sid
@@ -219,95 +497,258 @@ def start_logs(data):
         socketio.emit('error', {'message': 'Not connected to Docker'}, room=sid)
         return
 
-    # Create unique stream key for this user and container
-    stream_key = f"{sid}:{container_id}"
-
     # Stop existing stream if any
-    if stream_key in active_streams:
-        stop_stream(stream_key)
+    stop_stream(sid, container_id)
+
+    if not _stream_slots.acquire(blocking=False):
+        socketio.emit('error', {'message': 'Too many active log streams, try again later'}, room=sid)
+        return
 
     try:
-        stop_event = threading.Event()
+        stop_event = StopEvent()
+        ring: deque = deque(maxlen=REPLAY_BUFFER_SIZE)
+        rate_limiter = LineRateLimiter()
+
+        def stream_logs(stop_event: StopEvent):
+            send_queue = session['send_queue']
+
+            def enqueue(entry: dict):
+                # Recorded before the send queue, so replay also recovers lines dropped for a slow client
+                ring.append(entry)
+                try:
+                    send_queue.put_nowait(entry)
+                except queue.Full:
+                    with session['send_lock']:
+                        session['dropped'] += 1
 
-        def stream_logs(stop_event: threading.Event):
             try:
                 # Send connection message
-                socketio.emit('log', {
+                enqueue_event(session, 'log', {
                     'message': f'Connected to container logs...',
                     'stream': 'system',
-                    'timestamp': datetime.now().isoformat()
-                }, room=sid)
+                    'timestamp': int(time.time() * 1000)
+                })
+
+                # Hot path: one clock read per line, shared by the rate limiter and the
+                # entry's timestamp (integer epoch milliseconds, which the client's Date() accepts)
+                now = time.time
+
+                docker_client = session['docker_client']
+                tty = docker_client.container_tty(container_id)
 
                 # Iterate over lines from Docker API
-                for log_message in session['docker_client'].stream_logs_generator(container_id, stop_event, follow=True, tail=50):
+                for stream, log_message in docker_client.stream_logs_generator(container_id, stop_event, follow=True, tail=50, tty=tty):
                     if stop_event.is_set():
                         break
 
-                    if log_message and log_message.strip():
-                        socketio.emit('log', {
-                            'message': log_message,
-                            'stream': 'stdout',
-                            'timestamp': datetime.now().isoformat()
-                        }, room=sid)
+                    # The generator only yields non-empty, stripped lines
+                    t = now()
+                    if not rate_limiter.allow(t):
+                        continue
+                    enqueue({'message': log_message, 'stream': stream, 'timestamp': int(t * 1000)})
 
             except Exception as e:
                 print(f"Log streaming error for user {sid}: {e}")
-                socketio.emit('error', {'message': f'Log stream error: {str(e)}'}, room=sid)
+                enqueue_event(session, 'error', {'message': f'Log stream error: {str(e)}'})
             finally:
-                # Clean up mapping if present
-                if stream_key in active_streams:
-                    try:
-                        del active_streams[stream_key]
-                    except KeyError:
-                        pass
-                socketio.emit('log', {
-                    'message': 'Log stream ended',
-                    'stream': 'system',
-                    'timestamp': datetime.now().isoformat()
-                }, room=sid)
-
-        # Start the thread
-        thread = threading.Thread(target=stream_logs, args=(stop_event,), daemon=True)
-        active_streams[stream_key] = {'thread': thread, 'stop_event': stop_event}
-        thread.start()
+                # Free the slot only once cleanup is done, so a new stream can't start alongside it
+                try:
+                    # The sender reports suppressed lines periodically; report the remainder before "ended"
+                    suppressed = rate_limiter.take_suppressed()
+                    if suppressed:
+                        enqueue(rate_summary_entry(suppressed))
+                    # Clean up mapping if it still belongs to this stream (a restart may have replaced it)
+                    user_streams = active_streams.get(sid)
+                    if user_streams and user_streams.get(container_id, {}).get('stop_event') is stop_event:
+                        user_streams.pop(container_id, None)
+                    enqueue_event(session, 'log', {
+                        'message': 'Log stream ended',
+                        'stream': 'system',
+                        'timestamp': int(time.time() * 1000)
+                    })
+                finally:
+                    _stream_slots.release()
+
+        ensure_sender(sid, session)
+
+        # Register the stream before submitting so its cleanup always finds the mapping
+        stream_info = {'future': None, 'stop_event': stop_event, 'ring': ring, 'rate_limiter': rate_limiter}
+        active_streams[sid][container_id] = stream_info
+        try:
+            stream_info['future'] = _executor.submit(stream_logs, stop_event)
+        except Exception:
+            # The worker never ran, so its cleanup won't remove the mapping
+            active_streams[sid].pop(container_id, None)
+            raise
 
     except Exception as e:
+        _stream_slots.release()
         print(f"Error starting logs for user {sid}: {e}")
         socketio.emit('error', {'message': f'Failed to start logs: {str(e)}'}, room=sid)
 
 
+@socketio.on('replay')
+def replay_logs(data):
+    """
+    Resend the most recent lines of a running stream. Only live streams can be replayed:
+    a stream's ring buffer goes away when the stream ends.
+    """
+    sid = request.sid
+    session = get_user_session(sid)
+    container_id = data.get('container_id')
+
+    info = active_streams.get(sid, {}).get(container_id)
+    if not info:
+        socketio.emit('error', {'message': 'Replay is only available while the log stream is running'}, room=sid)
+        return
+
+    # Lines still waiting in the send queue are already in the ring; take them out so they
+    # aren't sent twice, but keep events and anything queued after the snapshot
+    ring = list(info['ring'])
+    replayed = set(map(id, ring))
+    send_queue = session['send_queue']
+    pending = []
+    try:
+        while True:
+            item = send_queue.get_nowait()
+            if isinstance(item, tuple) or id(item) not in replayed:
+                pending.append(item)
+    except queue.Empty:
+        pass
+
+    # Replay through the sender in LOG_BATCH_SIZE chunks, so a slow client gets the same backpressure
+    enqueue_event(session, 'replay_started', {'container_id': container_id})
+    # Don't wait for room per chunk like enqueue_event; a full queue counts the chunk as dropped
+    for i in range(0, len(ring), LOG_BATCH_SIZE):
+        chunk = ring[i:i + LOG_BATCH_SIZE]
+        try:
+            send_queue.put_nowait(('log_batch', chunk))
+        except queue.Full:
+            with session['send_lock']:
+                session['dropped'] += len(chunk)
+    for item in pending:
+        if isinstance(item, tuple):
+            enqueue_event(session, *item)
+            continue
+        try:
+            send_queue.put_nowait(item)
+        except queue.Full:
+            with session['send_lock']:
+                session['dropped'] += 1
+
+
 @socketio.on('stop_logs')
 def handle_stop_logs():
     sid = request.sid
+    session = get_user_session(sid)
     # Stop all streams for this user
     stop_user_streams(sid)
 
-    socketio.emit('log', {
+    ensure_sender(sid, session)
+    enqueue_event(session, 'log', {
         'message': 'Disconnected from logs',
         'stream': 'system',
-        'timestamp': datetime.now().isoformat()
-    }, room=sid)
+        'timestamp': int(time.time() * 1000)
+    })
 
 
-def stop_stream(stream_key: str):
+def stop_stream(sid: str, container_id: str):
     """Signal the stream's stop_event and remove it from active_streams."""
-    info = active_streams.get(stream_key)
-    if not info:
+    user_streams = active_streams.get(sid)
+    if not user_streams:
         return
-    ev = info.get('stop_event')
-    if isinstance(ev, threading.Event):
-        ev.set()
-    # Remove mapping immediately; thread's finally will tolerate absence
-    try:
-        del active_streams[stream_key]
-    except KeyError:
-        pass
+    # Remove mapping immediately; the worker's finally will tolerate absence
+    info = user_streams.pop(container_id, None)
+    if info:
+        info['stop_event'].set()
 
 
 def stop_user_streams(sid: str):
-    keys = [k for k in list(active_streams.keys()) if k.startswith(f"{sid}:")]
-    for k in keys:
-        stop_stream(k)
+    for info in active_streams.pop(sid, {}).values():
+        info['stop_event'].set()
+
+    # Discard lines still waiting to be sent so they don't show up after the stop, but keep
+    # queued events: the stopped workers' "Log stream ended" may already be among them.
+    # Filtered in place under the queue's own lock so events keep their order.
+    session = user_sessions.get(sid)
+    if session:
+        send_queue = session['send_queue']
+        with send_queue.mutex:
+            send_queue.queue = deque(item for item in send_queue.queue if isinstance(item, tuple))
+            send_queue.not_full.notify_all()
+
+
+def enqueue_event(session: dict, event: str, data: Union[dict, list]):
+    """
+    Queue a non-log-line event (system message, error) behind the lines already queued,
+    so the client receives them in order. Waits briefly for room rather than dropping it.
+    """
+    try:
+        session['send_queue'].put((event, data), timeout=1.0)
+    except queue.Full:
+        with session['send_lock']:
+            session['dropped'] += 1
+
+
+def ensure_sender(sid: str, session: dict):
+    """Start the session's send loop on first use."""
+    # Handlers run on their own threads, so check-and-set under the lock to start only one sender
+    with session['send_lock']:
+        if session['sender_started']:
+            return
+        session['sender_started'] = True
+    socketio.start_background_task(send_loop, sid, session)
+
+
+def send_loop(sid: str, session: dict):
+    """
+    Drain the session's send queue into 'log_batch' emits and report dropped lines.
+    Queue items are log entry dicts, or (event, data) tuples from enqueue_event, which
+    are emitted right after the lines queued before them.
+    """
+    send_queue = session['send_queue']
+    stop_event = session['sender_stop']
+    next_drop_report = time.monotonic() + DROP_REPORT_INTERVAL
+
+    while not stop_event.is_set():
+        batch = []
+        event = None
+        try:
+            item = send_queue.get(timeout=LOG_FLUSH_INTERVAL)
+            # Keep collecting until the batch fills up, the flush interval elapses or an event comes up
+            deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+            while True:
+                if isinstance(item, tuple):
+                    event = item
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= LOG_BATCH_SIZE or remaining <= 0:
+                    break
+                item = send_queue.get(timeout=remaining)
+        except queue.Empty:
+            pass
+
+        if batch:
+            socketio.emit('log_batch', batch, room=sid)
+        if event:
+            socketio.emit(event[0], event[1], room=sid)
+
+        if time.monotonic() >= next_drop_report:
+            next_drop_report = time.monotonic() + DROP_REPORT_INTERVAL
+            with session['send_lock']:
+                dropped, session['dropped'] = session['dropped'], 0
+            if dropped:
+                socketio.emit('log_dropped', {'count': dropped}, room=sid)
+
+            # Report rate-limited lines on a timer, so a burst followed by silence still gets its summary
+            summaries = []
+            for info in list(active_streams.get(sid, {}).values()):
+                suppressed = info['rate_limiter'].take_suppressed()
+                if suppressed:
+                    summaries.append(rate_summary_entry(suppressed))
+            if summaries:
+                socketio.emit('log_batch', summaries, room=sid)
 
 
 @socketio.on('disconnect')
@@ -320,7 +761,10 @@ def on_disconnect():
 
     # Remove user session
     if sid in user_sessions:
-        del user_sessions[sid]
+        session = user_sessions.pop(sid)
+        session['sender_stop'].set()
+        if session['docker_client']:
+            session['docker_client'].close()
 
 
 if __name__ == '__main__':